@@ -5,23 +5,99 @@ from typing import Optional
 import logging
 import re
 import time
-import pathlib
 import shutil
 import os
 import atexit
 import threading
 import json
+import errno
+import hashlib
+import fcntl
+import signal
+import ctypes
+import ctypes.util
+import select
+import struct
+from concurrent.futures import ThreadPoolExecutor
 
 from makemkvkey import updateMakeMkvKey
 
+_BLKID_RE = re.compile(r'(\w+)="([^"]+)"')
+_DRIVE_NUM_RE = re.compile(r"\d+")
+# Track lines in cdparanoia -Q output, eg.
+#   1.    16503 [03:40.03]        0 [00:00.00]    no   no  2
+_CDP_TRACK_RE = re.compile(r"^\s*\d+\.\s+(\d+)\s", re.M)
+
+
+_PIPE_BUFSIZE = 65536
+_PROGRESS_LOG_INTERVAL = 1  # Seconds
+
+
+def _log_subprocess_line(line: bytes):
+    if line:
+        logging.info("SUBPROCESS: %r", line.decode("utf-8", "replace"))
+
 
 def log_subprocess_output(pipe):
-    for line in iter(pipe.readline, b""):  # b'\n'-separated lines
-        logging.info("SUBPROCESS: %r", line.decode("utf-8"))
+    log_enabled = logging.getLogger().isEnabledFor(logging.INFO)
+    last_progress_time = 0.0
+    unlogged_frame = b""
+
+    # Read whatever is available in large chunks and split lines here,
+    # rather than issuing a small read per line
+    pending = b""
+    for chunk in iter(lambda: pipe.read1(_PIPE_BUFSIZE), b""):
+        if not log_enabled:
+            continue  # Keep draining so the process doesn't block
+
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            # Only the last redraw of a \r-updated line is worth keeping
+            line = line.rstrip(b"\r").rsplit(b"\r", 1)[-1]
+            _log_subprocess_line(line or unlogged_frame)
+            unlogged_frame = b""
+
+        # Progress output (dd, makemkvcon) redraws a single line with \r,
+        # so log at most one frame per interval
+        if b"\r" in pending:
+            frames, pending = pending.rsplit(b"\r", 1)
+            now = time.monotonic()
+            unlogged_frame = frames.rsplit(b"\r", 1)[-1]
+            if now - last_progress_time >= _PROGRESS_LOG_INTERVAL:
+                last_progress_time = now
+                _log_subprocess_line(unlogged_frame)
+                unlogged_frame = b""
+
+    _log_subprocess_line(pending or unlogged_frame)
+
+
+# Long-running subprocesses (rips, transcodes), so they can be stopped
+# on shutdown instead of outliving the script
+_processes = set()
+_processes_lock = threading.Lock()
+_shutting_down = False
+
+
+# Terminates running subprocesses and stops execute() from starting new
+# ones (other than those passed run_during_shutdown=True)
+def terminate_processes():
+    global _shutting_down
+    with _processes_lock:
+        _shutting_down = True
+        processes = list(_processes)
+    for process in processes:
+        logging.info("Terminating: %s", process.args[0])
+        process.terminate()
 
 
 # Timeout is in seconds
-def execute(cmd, capture=True, cwd=None) -> Optional[str]:
+def execute(
+    cmd, capture=True, cwd=None, run_during_shutdown=False
+) -> Optional[str]:
+    if _shutting_down and not run_during_shutdown:
+        raise Exception(f"Shutting down, not running: {cmd[0]}")
+
     if capture:
         return (
             subprocess.check_output(cmd, cwd=cwd, stderr=subprocess.STDOUT)
@@ -29,12 +105,27 @@ def execute(cmd, capture=True, cwd=None) -> Optional[str]:
             .decode("utf-8")
         )
 
-    process = subprocess.Popen(
-        cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-    )
-    with process.stdout:
-        log_subprocess_output(process.stdout)
-    exitcode = process.wait()  # 0 means success
+    # Start and register under the lock so terminate_processes() can't
+    # miss a process started while it runs
+    with _processes_lock:
+        if _shutting_down and not run_during_shutdown:
+            raise Exception(f"Shutting down, not running: {cmd[0]}")
+
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=_PIPE_BUFSIZE,
+        )
+        _processes.add(process)
+    try:
+        with process.stdout:
+            log_subprocess_output(process.stdout)
+        exitcode = process.wait()  # 0 means success
+    finally:
+        with _processes_lock:
+            _processes.discard(process)
     if exitcode != 0:
         raise Exception(exitcode)
 
@@ -45,14 +136,16 @@ def execute(cmd, capture=True, cwd=None) -> Optional[str]:
 # A="B" C="D" E="F"
 # Values CAN contain spaces, but they are always quoted
 def parse_blkid_params(params_str: str) -> dict:
-    params = {}
-    for match in re.finditer(r'(\w+)="([^"]+)"', params_str):
-        key = match.group(1)
-        value = match.group(2)
-        params[key] = value
-    return params
+    return dict(_BLKID_RE.findall(params_str))
 
 
+# Parses a single "DEVICE: A="B" C="D"" line, eg. the output of
+# blkid for a single device
+def parse_blkid_line(line: str) -> dict:
+    return parse_blkid_params(line.partition(": ")[2])
+
+
+# Parses blkid output for any number of devices, keyed by device
 def parse_blkid(blkid_str: str) -> dict:
     blkid = {}
     for line in blkid_str.split("\n"):
@@ -66,44 +159,151 @@ def parse_blkid(blkid_str: str) -> dict:
     return blkid
 
 
-# Returns a hash of the lengths of the tracks
-def cdparanoia_hash(cdp_str: str) -> int:
-    lines = cdp_str.split("\n")[6:-2]
-    lengths = []
-    for line in lines:
-        split = line.split()
-        if len(split) != 8:
-            continue
+# Returns a hash of the lengths of the tracks as a hex string. This must
+# be stable across runs since it's used to detect already ripped CDs, so
+# the builtin (per-process randomized) hash() can't be used.
+def cdparanoia_hash(cdp_str: str) -> str:
+    lengths = (int(x) for x in _CDP_TRACK_RE.findall(cdp_str))
+    return hashlib.blake2b(
+        ",".join(str(x) for x in lengths).encode(), digest_size=8
+    ).hexdigest()
 
-        lengths.append(int(split[1]))
-    return hash(tuple(lengths))
 
+# Returns the names of all entries in a directory, or an empty set if it
+# doesn't exist yet
+def scan_names(dir_path: str) -> set[str]:
+    try:
+        with os.scandir(dir_path) as entries:
+            return {entry.name for entry in entries}
+    except FileNotFoundError:
+        return set()
+
+
+# From <linux/cdrom.h>
+CDROM_DRIVE_STATUS = 0x5326
+CDS_NO_INFO = 0
+CDS_NO_DISC = 1
+CDS_TRAY_OPEN = 2
+CDS_DRIVE_NOT_READY = 3
+CDS_DISC_OK = 4
+
+
+# Asks the drive whether it has a disc in it, which is much cheaper than
+# probing with blkid/cdparanoia. Returns None if the status can't be read
+# (eg. not a CD-ROM device, or a drive that doesn't report status), in
+# which case callers should probe anyway.
+def drive_has_disc(drive: str) -> Optional[bool]:
+    try:
+        fd = os.open(drive, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError as e:
+        logging.debug("drive open error: %s", e)
+        return None
 
-def trysudo(cmd: list[str]):
     try:
-        execute(cmd, capture=False)
+        status = fcntl.ioctl(fd, CDROM_DRIVE_STATUS, 0)
+    except OSError as e:
+        logging.debug("CDROM_DRIVE_STATUS error: %s", e)
+        return None
+    finally:
+        os.close(fd)
+
+    if status == CDS_DISC_OK:
+        return True
+    if status in (CDS_NO_DISC, CDS_TRAY_OPEN, CDS_DRIVE_NOT_READY):
+        return False
+    logging.debug("CDROM_DRIVE_STATUS: %s", status)
+    return None
+
+
+def nvenc_available() -> bool:
+    if shutil.which("nvidia-smi") is None:
+        return False
+
+    try:
+        encoders = execute(
+            ["ffmpeg", "-hide_banner", "-encoders"], capture=True
+        )
+    except Exception as e:
+        logging.debug("ffmpeg encoders error: %s", e)
+        return False
+
+    return "h264_nvenc" in encoders
+
+
+def trysudo(cmd: list[str], run_during_shutdown=False):
+    try:
+        execute(cmd, capture=False, run_during_shutdown=run_during_shutdown)
     except Exception as e:
         logging.debug("trysudo error: %s", e)
         logging.info("Retrying with sudo...")
         cmd = ["sudo"] + cmd
-        execute(cmd, capture=False)
+        execute(cmd, capture=False, run_during_shutdown=run_during_shutdown)
 
 
 def eject(drive: str):
     trysudo(["eject", "-F", drive])
 
 
+_ensured_dirs: set[str] = set()
+
+
+# Like os.makedirs(path, exist_ok=True), but remembers the directories it
+# has made so repeat calls don't touch the filesystem
+def _ensure_dir(path: str):
+    if path not in _ensured_dirs:
+        os.makedirs(path, exist_ok=True)
+        _ensured_dirs.add(path)
+
+
+def _remove_dir(path: str):
+    _ensured_dirs.discard(path)
+    os.rmdir(path)
+
+
+# Returns True if both paths are on the same filesystem (creating them if
+# needed), so files can probably be moved between them with a single
+# rename. Subfolders may still be separate mounts, so this is only a hint.
+def same_filesystem(path_a: str, path_b: str) -> bool:
+    try:
+        _ensure_dir(path_a)
+        _ensure_dir(path_b)
+        return os.stat(path_a).st_dev == os.stat(path_b).st_dev
+    except OSError as e:
+        logging.debug("same_filesystem error: %s", e)
+        return False
+
+
+# dst must be the full destination path, not a directory to move into.
+# Tries a plain rename first when same_fs suggests it will work, falling
+# back to shutil.move across filesystems.
+def fast_move(src: str, dst: str, same_fs: bool):
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+
+    if same_fs:
+        try:
+            os.replace(src, dst)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            logging.debug("Not on the same filesystem, copying: %s", dst)
+
+    shutil.move(src, dst)
+
+
 _mounts = []
 
 
 def mount(drive: str, mnt_path: str):
-    os.makedirs(mnt_path, exist_ok=True)
+    _ensure_dir(mnt_path)
     trysudo(["mount", drive, mnt_path])
     _mounts.append(mnt_path)
 
 
 def unmount(mnt_path: str):
-    trysudo(["umount", mnt_path])
+    # Also used by the atexit cleanup, after subprocesses are shut down
+    trysudo(["umount", mnt_path], run_during_shutdown=True)
 
 
 @atexit.register
@@ -112,6 +312,71 @@ def mount_cleanup():
         unmount(mnt)
 
 
+# inotify event masks (from <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+# Minimal ctypes wrapper around Linux inotify, so loops can block until a
+# file changes instead of sleeping a fixed amount of time
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+        self._libc = libc
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    # Blocks for up to timeout seconds, returns a list of
+    # (wd, mask, name) tuples (empty if nothing happened)
+    def read(self, timeout: Optional[float] = None) -> list:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class StoppableThread(threading.Thread):
     def __init__(self):
         super().__init__()
@@ -132,26 +397,78 @@ class LoopThread(StoppableThread):
     def loop_step(self):
         pass
 
+    # Waits between loop steps, returns early if the thread is stopped
+    def wait(self):
+        self._stop_event.wait(self._interval)
+
     def run(self):
         while not self.stopped():
-            self.loop_step()
-            time.sleep(self._interval)
+            try:
+                self.loop_step()
+            except Exception as e:
+                # Subprocesses are terminated on shutdown, which fails
+                # whatever step was in progress
+                if not self.stopped():
+                    raise
+                logging.debug("%s stopped during loop step: %s", self.name, e)
+            self.wait()
 
 
 class TranscodeThread(LoopThread):
+    _WIP_EVENTS = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE
+
     def __init__(
-        self, wip_root: str, out_root: str, ffmpeg_args: Optional[list] = None
+        self,
+        wip_root: str,
+        out_root: str,
+        ffmpeg_args: Optional[list] = None,
+        hwaccel: str = "auto",
+        max_transcodes: int = 0,
     ):
         super().__init__()
         self.wip_root = wip_root
         self.out_root = out_root
 
-        if ffmpeg_args is None:
+        # "auto" uses NVENC when an NVIDIA GPU and a CUDA-enabled ffmpeg
+        # are available, otherwise falls back to libx264
+        if hwaccel == "auto":
+            hwaccel = "cuda" if nvenc_available() else "none"
+        self.hwaccel = hwaccel
+        logging.info("Transcode hardware acceleration: %s", self.hwaccel)
+
+        if ffmpeg_args is None and self.hwaccel == "cuda":
+            ffmpeg_args = [
+                "-c:v",
+                "h264_nvenc",
+                "-preset",
+                "p5",
+                "-rc",
+                "vbr",
+                "-cq",
+                "19",
+                "-b:v",
+                "0",
+                "-surfaces",
+                "32",
+                "-map",
+                "0",
+                "-c:a",
+                "copy",
+                "-c:s",
+                "copy",
+            ]
+        elif ffmpeg_args is None:
             ffmpeg_args = [
                 "-c:v",
                 "libx264",
+                "-preset",
+                "veryfast",
+                "-tune",
+                "film",
                 "-crf",
-                "18",
+                "20",
+                "-threads",
+                "0",
                 "-map",
                 "0",
                 "-c:a",
@@ -160,45 +477,250 @@ class TranscodeThread(LoopThread):
                 "copy",
             ]
         self.ffmpeg_args = ffmpeg_args
+
+        # Decoding on the GPU leaves frames in GPU memory, which only NVENC
+        # can take, so custom args with a CPU encoder decode on the CPU
+        self._cuda_decode = self.hwaccel == "cuda" and any(
+            arg.endswith("_nvenc") for arg in ffmpeg_args
+        )
+
+        # Limit on files being encoded at once across all discs. Consumer
+        # NVIDIA cards only allow a few concurrent NVENC sessions, and
+        # libx264 already spreads each encode over every core.
+        if max_transcodes <= 0:
+            max_transcodes = 3 if self.hwaccel == "cuda" else 2
+        self.max_transcodes = max_transcodes
+        self._transcode_slots = threading.Semaphore(max_transcodes)
+        self._transcode_slots_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_transcodes, thread_name_prefix="transcode"
+        )
+        self._disc_futures = {}
+
         self.wip_dvd_root = f"{self.wip_root}/dvd"
-        os.makedirs(self.wip_dvd_root, exist_ok=True)
+        _ensure_dir(self.wip_dvd_root)
+        self._same_fs = same_filesystem(self.wip_root, self.out_root)
 
-    def _wait_for_file_stable(self, file_path: str, wait_time: int = 10):
-        size1 = os.path.getsize(file_path)
-        logging.debug(f"size1: {size1}")
+        self._watched = {}  # Watched path -> watch descriptor
 
-        time.sleep(wait_time)  # Wait to see if the file size changes
-        size2 = os.path.getsize(file_path)
-        logging.debug(f"size2: {size2}")
-        if size1 != size2:
-            raise Exception(
-                f"File {file_path} is not done being written "
-                "(file size changed)"
-            )
+        # Written to by stop() to interrupt wait()
+        self._wake_r, self._wake_w = os.pipe()
+
+        # Wake up as soon as MakeMKV output lands in wip, falling back to
+        # plain polling if inotify isn't available
+        try:
+            self._inotify = Inotify()
+        except OSError as e:
+            logging.debug("inotify unavailable, polling instead: %s", e)
+            self._inotify = None
+        self._watch(self.wip_dvd_root)
+
+    def _watch(self, dir_path: str):
+        if self._inotify is None or dir_path in self._watched:
+            return
 
-    def transcode_file(self, file_path: str, out_path: str):
-        self._wait_for_file_stable(file_path)
+        try:
+            wd = self._inotify.add_watch(dir_path, self._WIP_EVENTS)
+        except OSError as e:
+            logging.debug("inotify add_watch error: %s", e)
+            return
+        self._watched[dir_path] = wd
 
-        os.makedirs(out_path, exist_ok=True)
+    def stop(self):
+        super().stop()
+        try:
+            os.write(self._wake_w, b"\0")
+        except (OSError, TypeError):
+            pass  # Already exited and closed the pipe
 
-        file_name = os.path.basename(file_path)
-        file_no_ext = os.path.splitext(file_name)[0]
-        out_file_path = f"{out_path}/{file_no_ext}.mp4"
+    def wait(self):
+        if self._inotify is None:
+            super().wait()
+            return
 
-        cmd = (
-            [
-                "ffmpeg",
-                "-i",
-                file_path,
-            ]
-            + self.ffmpeg_args
-            + [out_file_path]
+        ready, _, _ = select.select(
+            [self._inotify.fd, self._wake_r], [], [], self._interval
         )
-        logging.debug(f"Executing: {' '.join(cmd)}")
-        execute(cmd, capture=False)
+        if self._inotify.fd in ready:
+            events = self._inotify.read(timeout=0)
+            logging.debug("inotify events: %s", events)
+
+            # The kernel drops the watch when a folder is removed
+            ignored = {wd for wd, mask, _ in events if mask & IN_IGNORED}
+            if ignored:
+                self._watched = {
+                    path: wd
+                    for path, wd in self._watched.items()
+                    if wd not in ignored
+                }
 
-        logging.debug(f"Removing file: {file_path}")
-        os.remove(file_path)
+    def run(self):
+        try:
+            super().run()
+        finally:
+            # Wait for in-progress transcodes, but don't start new ones
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            if self._inotify is not None:
+                self._inotify.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._wake_w = None
+
+    def _acquire_transcode_slots(self, count: int):
+        # Take all slots under a lock so two batches can't each end up
+        # holding part of what the other is waiting for
+        with self._transcode_slots_lock:
+            for _ in range(count):
+                self._transcode_slots.acquire()
+
+    def _release_transcode_slots(self, count: int):
+        for _ in range(count):
+            self._transcode_slots.release()
+
+    # Returns None if the file can't be watched (eg. no inotify support)
+    def _watch_file(self, file_path: str) -> Optional[Inotify]:
+        try:
+            inotify = Inotify()
+        except OSError as e:
+            logging.debug("inotify error: %s", e)
+            return None
+
+        try:
+            inotify.add_watch(file_path, IN_MODIFY)
+        except OSError as e:
+            logging.debug("inotify add_watch error: %s", e)
+            inotify.close()
+            return None
+        return inotify
+
+    # Checks the file again after each delay, returning as soon as it goes
+    # a whole delay without being written to
+    def _wait_for_file_stable(
+        self,
+        file_path: str,
+        delays: tuple = (0.5, 1, 2, 4),
+        quiet_time: float = 2,
+    ):
+        stat = os.stat(file_path)
+        logging.debug("size: %s, mtime: %s", stat.st_size, stat.st_mtime)
+
+        # Nothing has written to the file lately, no need to watch it
+        if stat.st_size > 0 and time.time() - stat.st_mtime > quiet_time:
+            return
+
+        inotify = self._watch_file(file_path)
+        try:
+            prev_size = stat.st_size
+            for delay in delays:
+                if inotify is None:
+                    time.sleep(delay)
+                    modified = False
+                else:
+                    modified = len(inotify.read(timeout=delay)) > 0
+
+                size = os.path.getsize(file_path)
+                logging.debug("size: %s, modified: %s", size, modified)
+                if not modified and size == prev_size and size > 0:
+                    return
+                prev_size = size
+        finally:
+            if inotify is not None:
+                inotify.close()
+
+        raise Exception(
+            f"File {file_path} is not done being written "
+            "(file size changed)"
+        )
+
+    _MAP_OPTIONS = ("-map", "-map_metadata", "-map_chapters")
+
+    def _output_args(self, input_index: int) -> list:
+        # ffmpeg_args are written for a single input, so point any
+        # "-map 0..." (and metadata/chapter maps) at this output's own
+        # input. Metadata and chapters otherwise come from the first input
+        # that has them, so every output would get the first title's.
+        args = []
+        for option in self._MAP_OPTIONS:
+            if option not in self.ffmpeg_args:
+                args += [option, str(input_index)]
+
+        prev_arg = None
+        for arg in self.ffmpeg_args:
+            if prev_arg in self._MAP_OPTIONS:
+                arg = re.sub(r"^(-?)0", rf"\g<1>{input_index}", arg)
+            args.append(arg)
+            prev_arg = arg
+        return args
+
+    # Transcodes all files in a single ffmpeg invocation, so process
+    # startup and encoder session setup only happen once per batch
+    def transcode_files(self, file_paths: list[str], out_path: str):
+        _ensure_dir(out_path)
+
+        cmd = ["ffmpeg"]
+        for file_path in file_paths:
+            if self._cuda_decode:
+                cmd += ["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"]
+            # DVD VOBs often have missing or broken timestamps
+            cmd += ["-fflags", "+genpts", "-i", file_path]
+
+        out_file_paths = []
+        for i, file_path in enumerate(file_paths):
+            file_name = os.path.basename(file_path)
+            file_no_ext = os.path.splitext(file_name)[0]
+            out_file_path = f"{out_path}/{file_no_ext}.mp4"
+            out_file_paths.append(out_file_path)
+            cmd += self._output_args(i) + [
+                "-avoid_negative_ts",
+                "make_zero",
+                # Keep streams with sparse packets (eg. subtitles) from
+                # stalling the muxer
+                "-max_muxing_queue_size",
+                "9999",
+                out_file_path,
+            ]
+
+        logging.debug("Executing: %s", " ".join(cmd))
+        try:
+            execute(cmd, capture=False)
+        except Exception:
+            # Don't leave partial outputs behind to be moved to out
+            for out_file_path in out_file_paths:
+                if os.path.exists(out_file_path):
+                    os.remove(out_file_path)
+            raise
+
+        for file_path in file_paths:
+            logging.debug("Removing file: %s", file_path)
+            os.remove(file_path)
+
+    def _transcode_batch(
+        self, batch: list[str], wip_transcode_path: str, disc_name: str
+    ):
+        try:
+            self.transcode_files(batch, wip_transcode_path)
+            logging.info(
+                "Finished transcoding %s file(s): %s", len(batch), disc_name
+            )
+            return
+        except Exception as e:
+            logging.debug("transcode_files error: %s", e)
+
+        if len(batch) == 1:
+            return
+
+        # One bad input fails the whole batch, so retry one file at a time
+        # to finish the good ones and only leave the broken one behind
+        logging.debug("Retrying batch one file at a time: %s", disc_name)
+        for file_path in batch:
+            if self.stopped():
+                return
+
+            try:
+                self.transcode_files([file_path], wip_transcode_path)
+                logging.info("Finished transcoding file: %s", file_path)
+            except Exception as e:
+                logging.debug("transcode_files error: %s", e)
 
     def transcode_disc(self, disc_name: str):
         wip_dvd_root = f"{self.wip_root}/dvd"
@@ -209,53 +731,115 @@ class TranscodeThread(LoopThread):
         wip_transcode_path = f"{wip_transcode_dvd_root}/{disc_name}"
         out_path = f"{out_dvd_root}/{disc_name}"
 
-        wip_files = os.listdir(wip_path)
-        logging.debug(f"wip_files: {wip_files}")
+        with os.scandir(wip_path) as entries:
+            wip_files = [entry.path for entry in entries if entry.is_file()]
+        logging.debug("wip_files: %s", wip_files)
 
-        for file in wip_files:
-            raw_file_path = f"{wip_path}/{file}"
-            transcode_file_path = f"{wip_transcode_path}/{file}"
+        if not wip_files and not os.path.isdir(wip_transcode_path):
+            # eg. MakeMKV found no titles. Remove the folder so the disc
+            # isn't treated as in progress forever.
             try:
-                self.transcode_file(raw_file_path, wip_transcode_path)
-                logging.info(f"Finished transcoding file: {file}")
+                logging.debug("Removing empty wip_path: %s", wip_path)
+                _remove_dir(wip_path)
+            except OSError:
+                logging.debug("wip_path not empty, not removing: %s", wip_path)
+            return
+
+        stable_files = []
+        for raw_file_path in wip_files:
+            try:
+                self._wait_for_file_stable(raw_file_path)
+                stable_files.append(raw_file_path)
             except Exception as e:
-                logging.debug(f"transcode_file error: {e}")
+                logging.debug("_wait_for_file_stable error: %s", e)
                 logging.debug("Maybe MakeMKV is still ripping the disc?")
 
+        for i in range(0, len(stable_files), self.max_transcodes):
+            if self.stopped():
+                return
+
+            batch = stable_files[i:i + self.max_transcodes]
+            self._acquire_transcode_slots(len(batch))
+            try:
+                self._transcode_batch(batch, wip_transcode_path, disc_name)
+            finally:
+                self._release_transcode_slots(len(batch))
+
         try:
-            logging.debug(f"Removing wip_path: {wip_path}")
-            os.rmdir(wip_path)
+            logging.debug("Removing wip_path: %s", wip_path)
+            _remove_dir(wip_path)
         except OSError:
-            logging.debug(f"wip_path not empty, not removing: {wip_path}")
+            logging.debug("wip_path not empty, not removing: %s", wip_path)
 
-        wip_transcode_files = os.listdir(wip_transcode_path)
-        logging.debug(f"wip_transcode_files: {wip_transcode_files}")
+        # Leave moving to out for the next run rather than holding up
+        # shutdown
+        if self.stopped():
+            return
+
+        try:
+            with os.scandir(wip_transcode_path) as entries:
+                wip_transcode_files = list(entries)
+        except FileNotFoundError:
+            logging.debug("No transcoded files yet: %s", disc_name)
+            return
+        logging.debug(
+            "wip_transcode_files: %s", [e.name for e in wip_transcode_files]
+        )
 
-        os.makedirs(out_path, exist_ok=True)
+        _ensure_dir(out_path)
 
-        for file in wip_transcode_files:
-            transcode_file_path = f"{wip_transcode_path}/{file}"
-            self._wait_for_file_stable(transcode_file_path)
-            shutil.move(transcode_file_path, out_path)
-            logging.debug(f"Moved transcoded file to out: {file}")
+        for entry in wip_transcode_files:
+            self._wait_for_file_stable(entry.path)
+            fast_move(entry.path, f"{out_path}/{entry.name}", self._same_fs)
+            logging.debug("Moved transcoded file to out: %s", entry.name)
 
         try:
-            logging.debug(f"Removing wip_transcode_path: {wip_transcode_path}")
-            os.rmdir(wip_transcode_path)
+            logging.debug(
+                "Removing wip_transcode_path: %s", wip_transcode_path
+            )
+            _remove_dir(wip_transcode_path)
         except OSError:
             logging.debug(
-                "wip_transcode_path not empty, not removing: "
-                f"{wip_transcode_path}"
+                "wip_transcode_path not empty, not removing: %s",
+                wip_transcode_path,
             )
 
+    def _transcode_disc_task(self, disc_name: str):
+        try:
+            self.transcode_disc(disc_name)
+        except Exception as e:
+            logging.warning("TranscodeThread transcode_disc: %s", e)
+
     def loop_step(self):
         logging.debug("Transcode loop step")
+        self._disc_futures = {
+            disc_name: future
+            for disc_name, future in self._disc_futures.items()
+            if not future.done()
+        }
         try:
-            for disc_name in os.listdir(self.wip_dvd_root):
-                logging.debug(f"Transcoding disc: {disc_name}")
-                self.transcode_disc(disc_name)
+            with os.scandir(self.wip_dvd_root) as entries:
+                disc_names = [e.name for e in entries if e.is_dir()]
+
+            # Forget folders that have been removed since the last step
+            disc_paths = {f"{self.wip_dvd_root}/{n}" for n in disc_names}
+            self._watched = {
+                path: wd
+                for path, wd in self._watched.items()
+                if path == self.wip_dvd_root or path in disc_paths
+            }
+
+            for disc_name in disc_names:
+                self._watch(f"{self.wip_dvd_root}/{disc_name}")
+                if disc_name in self._disc_futures:
+                    continue
+
+                logging.debug("Transcoding disc: %s", disc_name)
+                self._disc_futures[disc_name] = self._executor.submit(
+                    self._transcode_disc_task, disc_name
+                )
         except Exception as e:
-            logging.warn(f"TranscodeThread loop_step: {e}")
+            logging.warning("TranscodeThread loop_step: %s", e)
 
 
 class RipThread(LoopThread):
@@ -270,81 +854,110 @@ class RipThread(LoopThread):
     ):
         super().__init__()
         self.drive = drive
+        # Number of the drive (eg. 0 for /dev/sr0, 1 for /dev/sr1, etc.),
+        # resolving symlinks like /dev/cdrom first. None if it can't be
+        # worked out, which only matters when ripping a DVD.
+        drive_num = _DRIVE_NUM_RE.search(
+            os.path.basename(os.path.realpath(drive))
+        )
+        self.drive_id = int(drive_num.group(0)) if drive_num else None
         self.wip_root = wip_root
+        self._wip_root_abs = os.path.abspath(wip_root)
         self.out_root = out_root
         self.skip_eject = skip_eject
         self.makemkv_update_key = makemkv_update_key
         self.makemkv_settings_path = makemkv_settings_path
+        self._same_fs = same_filesystem(self.wip_root, self.out_root)
+
+        # Names known to exist in out/dvd and out/iso, scanned once at
+        # startup and added to as outputs appear, so a disc left in the
+        # drive isn't re-checked on disk every loop once it's done
+        self._out_names = {
+            kind: scan_names(f"{self.out_root}/{kind}")
+            for kind in ("dvd", "iso")
+        }
         logging.debug("RipThread initialized")
 
+    def _out_exists(self, kind: str, name: str) -> bool:
+        if name in self._out_names[kind]:
+            return True
+
+        # Outputs can appear without us knowing (eg. DVDs are moved to out
+        # by the transcode thread), so check the disk on a cache miss
+        if os.path.lexists(f"{self.out_root}/{kind}/{name}"):
+            self._out_names[kind].add(name)
+            return True
+        return False
+
     def rip_dvd(self, blkid_params: dict):
         disc_name = f"{blkid_params['LABEL']}-{blkid_params['UUID']}"
         wip_rip_path = f"{self.wip_root}/dvd_rip/{disc_name}"
         wip_path = f"{self.wip_root}/dvd/{disc_name}"
         out_path = f"{self.out_root}/dvd/{disc_name}"
 
-        if pathlib.Path(out_path).exists():
-            logging.info(f"Output path exists: {out_path}")
+        if self._out_exists("dvd", disc_name):
+            logging.info("Output path exists: %s", out_path)
             return
 
-        if pathlib.Path(wip_path).exists():
-            logging.info(f"WIP path exists: {wip_path}")
+        if os.path.lexists(wip_path):
+            logging.info("WIP path exists: %s", wip_path)
             return
 
+        if self.drive_id is None:
+            raise Exception(
+                f"Can't determine MakeMKV drive number for {self.drive}"
+            )
+
         if self.makemkv_update_key:
             updateMakeMkvKey(self.makemkv_settings_path)
 
-        logging.info(f"Ripping DVD: {disc_name}")
+        logging.info("Ripping DVD: %s", disc_name)
 
         shutil.rmtree(wip_rip_path, ignore_errors=True)
         os.makedirs(wip_rip_path, exist_ok=True)
 
-        # Get number of the drive (eg. 0 for /dev/sr0, 1 for /dev/sr1, etc.)
-        drive_id = int(re.search(r"\d+", self.drive).group(0))
-        o_path_abs = os.path.abspath(wip_rip_path)
+        o_path_abs = f"{self._wip_root_abs}/dvd_rip/{disc_name}"
 
         cmd = [
             "makemkvcon",
             "mkv",
-            f"disc:{drive_id}",
+            f"disc:{self.drive_id}",
             "all",
             f"{o_path_abs}",
         ]
-        logging.debug(f"Executing: {' '.join(cmd)}")
+        logging.debug("Executing: %s", " ".join(cmd))
         execute(cmd, capture=False)
 
-        os.makedirs(wip_path, exist_ok=True)
-        # Move all files from the rip folder to the final wip folder,
-        # then remove the rip folder
-        for entry in os.listdir(wip_rip_path):
-            src = os.path.join(wip_rip_path, entry)
-            logging.debug(
-                "Moving from rip path to wip path: "
-                f"{src} -> {wip_path}"
-            )
-            shutil.move(src, wip_path)
-
-        os.rmdir(wip_rip_path)
+        # Move the whole rip folder into place in one rename, so the
+        # transcode thread never sees (and removes) a half-filled or empty
+        # wip folder. Both are under wip_root, so this is normally a
+        # rename, but falls back to copying if wip/dvd is its own mount.
+        _ensure_dir(f"{self.wip_root}/dvd")
+        logging.debug(
+            "Moving from rip path to wip path: %s -> %s",
+            wip_rip_path,
+            wip_path,
+        )
+        fast_move(wip_rip_path, wip_path, True)
 
         # Transcoding is handled in its own thread, so we're done here!
-        logging.info(f"Finished ripping DVD, wait for transcode: {disc_name}")
+        logging.info("Finished ripping DVD, wait for transcode: %s", disc_name)
 
     def rip_redbook(self, cdp_str: str):
         cdp_hash = cdparanoia_hash(cdp_str)
-        cdp_hash = str(hex(abs(cdp_hash)))[2:]
 
         # Check if any folders in out begin with the hash
         out_dir_path = f"{self.out_root}/redbook"
-        os.makedirs(out_dir_path, exist_ok=True)
+        _ensure_dir(out_dir_path)
         for folder in os.listdir(out_dir_path):
             if folder.endswith(cdp_hash):
-                logging.info(f"Redbook already ripped: {folder}")
+                logging.info("Redbook already ripped: %s", folder)
                 return
 
-        logging.info(f"Ripping redbook: {cdp_hash}")
+        logging.info("Ripping redbook: %s", cdp_hash)
 
         wip_dir_path = f"{self.wip_root}/redbook"
-        os.makedirs(wip_dir_path, exist_ok=True)
+        _ensure_dir(wip_dir_path)
 
         pwd = os.getcwd()
         os.chdir(wip_dir_path)
@@ -356,9 +969,9 @@ class RipThread(LoopThread):
         album_name = os.listdir(wip_dir_path)[0]
 
         out_path = f"{out_dir_path}/{album_name}-{cdp_hash}"
-        shutil.move(f"{wip_dir_path}/{album_name}", out_path)
+        fast_move(f"{wip_dir_path}/{album_name}", out_path, self._same_fs)
 
-        logging.info(f"Finished ripping redbook: {cdp_hash}")
+        logging.info("Finished ripping redbook: %s", cdp_hash)
 
     def rip_data_disc(self, blkid_params: dict):
         file_name = f"{blkid_params['LABEL']}-{blkid_params['UUID']}.iso"
@@ -367,66 +980,95 @@ class RipThread(LoopThread):
         wip_path = f"{wip_dir_path}/{file_name}"
         out_path = f"{out_dir_path}/{file_name}"
 
-        if pathlib.Path(out_path).exists():
-            logging.info(f"Output path exists: {out_path}")
+        if self._out_exists("iso", file_name):
+            logging.info("Output path exists: %s", out_path)
             return
 
-        logging.info(f"Ripping data disc: {file_name}")
+        logging.info("Ripping data disc: %s", file_name)
 
-        os.makedirs(wip_dir_path, exist_ok=True)
-        os.makedirs(out_dir_path, exist_ok=True)
+        _ensure_dir(wip_dir_path)
+        _ensure_dir(out_dir_path)
 
-        cmd = ["dd", f"if={self.drive}", f"of={wip_path}", "status=progress"]
-        logging.debug(f"Executing: {' '.join(cmd)}")
+        # Large direct reads instead of dd's default 512 byte blocks through
+        # the page cache
+        cmd = [
+            "dd",
+            f"if={self.drive}",
+            f"of={wip_path}",
+            "bs=1M",
+            "iflag=direct",
+            "status=progress",
+        ]
+        logging.debug("Executing: %s", " ".join(cmd))
         execute(cmd, capture=False, cwd=os.getcwd())
 
         # Move the file to the out folder
-        shutil.move(wip_path, out_path)
+        fast_move(wip_path, out_path, self._same_fs)
+        self._out_names["iso"].add(file_name)
 
-        logging.info(f"Finished ripping data disc: {file_name}")
+        logging.info("Finished ripping data disc: %s", file_name)
 
     def rip_bluray(blkid_params: dict):
         raise NotImplementedError("Blu-ray ripping is not yet implemented")
 
+    def is_dvd_video(self, blkid_params: dict) -> bool:
+        # DVD-Video discs are UDF (blkid reports the UDF/ISO 9660 bridge as
+        # udf), so a plain ISO 9660 disc can be ruled out without mounting
+        if blkid_params.get("TYPE") == "iso9660":
+            logging.debug("ISO 9660 filesystem, not a DVD-Video disc")
+            return False
+
+        mnt_path = f"./mnt{self.drive}"
+        try:
+            mount(self.drive, mnt_path)
+        except Exception as e:
+            logging.debug("mount error: %s", e)
+
+        # Check if "VIDEO_TS" exists
+        video_ts_path = f"{mnt_path}/VIDEO_TS"
+        logging.debug("Checking for DVD at: %s", video_ts_path)
+        video_ts_exists = os.path.lexists(video_ts_path)
+        logging.debug("video_ts_exists: %s", video_ts_exists)
+        return video_ts_exists
+
     def loop_step(self):
         logging.debug("Rip loop step")
+        if drive_has_disc(self.drive) is False:
+            logging.debug("No disc detected (drive status)")
+            return
+
         blkid_str = None
         try:
             blkid_str = execute(["blkid", self.drive], capture=True)
         except Exception as e:
             logging.debug("blkid error: %s", e)
 
-        try:
-            cdp_text = execute(["cdparanoia", "-sQ"], capture=True)
-            logging.info("Redbook disc detected")
-            self.rip_redbook(cdp_text)
-            if not self.skip_eject:
-                eject(self.drive)
-            return
-        except subprocess.CalledProcessError as e:
-            logging.debug("cdparanoia error: %s", e)
-            logging.debug("No redbook disc detected")
+        blkid_params = {}
+        if blkid_str:
+            logging.debug("blkid_str: %s", blkid_str)
+            blkid_params = parse_blkid_line(blkid_str)
+            logging.debug("params: %s", blkid_params)
+
+        # Audio CDs never have a UDF filesystem, so skip the cdparanoia
+        # probe for those. ISO 9660 still needs probing since enhanced CDs
+        # (audio tracks plus a data session) report it too.
+        if blkid_params.get("TYPE") != "udf":
+            try:
+                cdp_text = execute(["cdparanoia", "-sQ"], capture=True)
+                logging.info("Redbook disc detected")
+                self.rip_redbook(cdp_text)
+                if not self.skip_eject:
+                    eject(self.drive)
+                return
+            except subprocess.CalledProcessError as e:
+                logging.debug("cdparanoia error: %s", e)
+                logging.debug("No redbook disc detected")
 
-        if (blkid_str is None) or (len(blkid_str) == 0):
+        if not blkid_params:
             logging.debug("No disc detected")
             return
 
-        logging.debug(f"blkid_str: {blkid_str}")
-        blkid_params = parse_blkid(blkid_str)[self.drive]
-        logging.debug(f"params: {blkid_params}")
-
-        mnt_path = f"./mnt{self.drive}"
-        try:
-            mount(self.drive, mnt_path)
-        except Exception as e:
-            logging.debug("mount error: %s", e)
-
-        # Check if "VIDEO_TS" exists
-        video_ts_path = f"{mnt_path}/VIDEO_TS"
-        logging.debug(f"Checking for DVD at: {video_ts_path}")
-        video_ts_exists = pathlib.Path(video_ts_path).exists()
-        logging.debug(f"video_ts_exists: {video_ts_exists}")
-        if video_ts_exists:
+        if self.is_dvd_video(blkid_params):
             logging.info("DVD detected")
             self.rip_dvd(blkid_params)
         else:
@@ -477,6 +1119,20 @@ if __name__ == "__main__":
         help="Path to the MakeMKV settings file",
         default="~/.MakeMKV/settings.conf",
     )
+    parser.add_argument(
+        "--hwaccel",
+        choices=["auto", "cuda", "none"],
+        default="auto",
+        help="Hardware acceleration for transcoding (auto uses NVENC if "
+        "available)",
+    )
+    parser.add_argument(
+        "--max-transcodes",
+        type=int,
+        default=0,
+        help="Maximum number of files to encode at once (0 for 3 with NVENC, "
+        "otherwise 2)",
+    )
     args = parser.parse_args()
 
     if args.config:
@@ -484,7 +1140,7 @@ if __name__ == "__main__":
             with open(args.config, "r") as f:
                 config = json.load(f)
         except Exception as e:
-            logging.warning(f"Error loading config file: {e}")
+            logging.warning("Error loading config file: %s", e)
             config = {}
         parser.set_defaults(**config)
         args = parser.parse_args()
@@ -498,7 +1154,9 @@ if __name__ == "__main__":
     transcode_thread = TranscodeThread(
         args.wip_root,
         args.out_root,
-        getattr(args, "ffmpeg_args", None)
+        getattr(args, "ffmpeg_args", None),
+        args.hwaccel,
+        args.max_transcodes,
     )
     rip_thread = RipThread(
         args.drive,
@@ -509,11 +1167,20 @@ if __name__ == "__main__":
         args.makemkv_settings_path,
     )
 
+    # Handle SIGTERM (eg. docker stop) the same as Ctrl+C
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
     transcode_thread.start()
     rip_thread.start()
     try:
         rip_thread.join()
     except KeyboardInterrupt:
-        pass
+        logging.info("Shutting down...")
+    rip_thread.stop()
     transcode_thread.stop()
+    terminate_processes()
+    rip_thread.join()
     transcode_thread.join()